@@ -1,9 +1,32 @@
 import matplotlib.pyplot as plt
 import gseapy as gp
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from concurrent.futures import ProcessPoolExecutor
 from collections import defaultdict
 from itertools import chain
 import os
 
+
+def _permutation_chunk(incidence, n_targets, observed, n_perm, seed_seq, batch_size=500):
+    """Counts permutations with pathway hits >= observed for one chunk (process pool worker)."""
+    rng = np.random.default_rng(seed_seq)
+    n_genes = incidence.shape[0]
+    exceed = np.zeros(incidence.shape[1], dtype=np.int64)
+    for start in range(0, n_perm, batch_size):
+        b = min(batch_size, n_perm - start)
+        # b random target sets of size n_targets, drawn without replacement
+        rows = np.argpartition(rng.random((b, n_genes)), n_targets - 1, axis=1)[:, :n_targets]
+        selection = sparse.csr_matrix(
+            (np.ones(b * n_targets, dtype=np.int32),
+             (np.repeat(np.arange(b), n_targets), rows.ravel())),
+            shape=(b, n_genes)
+        )
+        counts = (selection @ incidence).toarray()
+        exceed += (counts >= observed).sum(axis=0)
+    return exceed
+
 class Utils:
     @staticmethod
     def flatten_list(nested_list):
@@ -24,9 +47,100 @@ class Utils:
                 for path in paths:
                     di_recon[path].append(p_code)
         return di_recon
-    
+
+    @staticmethod
+    def fdr_bh(pvalues):
+        """Benjamini-Hochberg adjusted p-values."""
+        pvalues = np.asarray(pvalues, dtype=float)
+        n = len(pvalues)
+        order = np.argsort(pvalues)
+        ranked = pvalues[order] * n / np.arange(1, n + 1)
+        ranked = np.minimum.accumulate(ranked[::-1])[::-1]
+        adjusted = np.empty(n)
+        adjusted[order] = np.minimum(ranked, 1.0)
+        return adjusted
+
+
+class OccupancyPermutation:
+    def __init__(self, background, n_permutations=10000, seed=0, n_jobs=None, chunk_size=1000):
+        """
+        Empirical significance of pathway occupancy by a target set.
+
+        :param background: Organism gene to pathways mapping, e.g. {"hsa:10327": ["path:hsa00010"]}.
+        :param n_permutations: Random target sets drawn from the background.
+        :param seed: Fixed seed; results do not depend on n_jobs.
+        :param n_jobs: Process pool size (None - all cores).
+        :param chunk_size: Permutations per pool task.
+        """
+        self.background = background
+        self.n_permutations = n_permutations
+        self.seed = seed
+        self.n_jobs = n_jobs
+        self.chunk_size = chunk_size
+
+    def incidence_matrix(self, gene_pathways, pathways):
+        """Sparse gene x pathway 0/1 matrix over the given pathways."""
+        genes = list(gene_pathways)
+        col = {pth: en for en, pth in enumerate(pathways)}
+        rows, cols = [], []
+        for en, gene in enumerate(genes):
+            for pth in set(gene_pathways[gene]):
+                if pth in col:
+                    rows.append(en)
+                    cols.append(col[pth])
+        incidence = sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.int32), (rows, cols)),
+            shape=(len(genes), len(pathways))
+        )
+        return genes, incidence
+
+    def run(self, target_pathways):
+        """
+        Computes empirical p-values and FDR for each pathway hit by the targets.
+
+        :param target_pathways: Target gene to pathways mapping.
+        :return: DataFrame indexed by pathway, sorted by significance.
+        """
+        # Targets missing from the background still belong to the universe
+        universe = dict(self.background)
+        for gene, paths in target_pathways.items():
+            universe[gene] = list(set(universe.get(gene, [])) | set(paths))
+
+        pathways = sorted(set(Utils.flatten_list(target_pathways.values())))
+        genes, incidence = self.incidence_matrix(universe, pathways)
+
+        index = {gene: en for en, gene in enumerate(genes)}
+        targets = [index[gene] for gene in target_pathways]
+        observed = np.asarray(incidence[targets].sum(axis=0)).ravel()
+
+        chunks = [
+            min(self.chunk_size, self.n_permutations - start)
+            for start in range(0, self.n_permutations, self.chunk_size)
+        ]
+        seeds = np.random.SeedSequence(self.seed).spawn(len(chunks))
+
+        with ProcessPoolExecutor(max_workers=self.n_jobs) as executor:
+            futures = [
+                executor.submit(_permutation_chunk, incidence, len(targets), observed, n_perm, seed_seq)
+                for n_perm, seed_seq in zip(chunks, seeds)
+            ]
+            exceed = sum(future.result() for future in futures)
+
+        pvalues = (exceed + 1) / (self.n_permutations + 1)
+
+        stats = pd.DataFrame({
+            "Targets": observed,
+            "Pathway_size": np.asarray(incidence.sum(axis=0)).ravel(),
+            "P-value": pvalues,
+            "FDR": Utils.fdr_bh(pvalues),
+        }, index=pd.Index(pathways, name="Pathway"))
+
+        return stats.sort_values(by=["P-value", "Targets"], ascending=[True, False])
+
+
 class Enrichment:
-    def __init__(self, mapping_object, pathways_name_mapping, organism="human", view_top_n=10, output=None):
+    def __init__(self, mapping_object, pathways_name_mapping, organism="human", view_top_n=10, output=None,
+                 background=None, rank_by="occupancy", n_permutations=10000, seed=0, n_jobs=None):
         self.pth   = self._ex_map(mapping_object)['PATHWAYS']
         self.gen   = self._ex_map(mapping_object)['GENENAME']
         self.ptu   = self._ex_map(mapping_object)['PATHWAYS_UNQ']
@@ -35,11 +149,24 @@ class Enrichment:
         self.organism = organism
         self.view_top_n = view_top_n 
         self.output = output
+        self.background = background
+        self.rank_by = rank_by
+        self.n_permutations = n_permutations
+        self.seed = seed
+        self.n_jobs = n_jobs
         # Default
         self.k2g_map = {}
         self.enr = None
+        self.pathway_stats = None
+        self._check_rank_by()
         self._make_out()
 
+    def _check_rank_by(self):
+        if self.rank_by not in ("occupancy", "significance"):
+            raise ValueError("Unsupported ranking. Use 'occupancy' or 'significance'")
+        if self.rank_by == "significance" and not self.background:
+            raise ValueError("Ranking by significance requires an organism background")
+
     def _make_out(self):
         if bool(self.output):
             os.makedirs(self.output, exist_ok=True)
@@ -71,6 +198,26 @@ class Enrichment:
                 for h in org: # many to 1, keep all
                     self.k2g_map[h] = k 
 
+    def produce_pathway_significance(self):
+        """Empirical p-values and FDR of pathway occupancy against the organism background."""
+        target_pathways = defaultdict(list)
+        for kegg_paths in self.pth.values():
+            for kegg_id, paths in kegg_paths.items():
+                target_pathways[kegg_id].extend(paths)
+
+        permutation = OccupancyPermutation(
+            self.background,
+            n_permutations=self.n_permutations,
+            seed=self.seed,
+            n_jobs=self.n_jobs
+        )
+        self.pathway_stats = permutation.run(target_pathways)
+        self.pathway_stats.insert(0, "Name", [self.p2n.get(i) for i in self.pathway_stats.index])
+
+        if bool(self.output):
+            self.pathway_stats.to_csv(os.path.join(self.output, "pathway_significance.csv"))
+        return self.pathway_stats
+
     def produce_stats_inner_comparison(self):
 
         targets_len = len(self.pth)
@@ -79,9 +226,16 @@ class Enrichment:
         p2a_map = Utils.p2a_mapping(self.pth)
         
         occupancy_stats = {pth : round(len(targets_list)/targets_len *100, 2) for pth, targets_list in p2a_map.items()}
-        
-        # Sort pathways per amount of targets present, descending
-        data_stats = dict(sorted(occupancy_stats.items(), key=lambda item: item[1], reverse=True))
+
+        if self.rank_by == "significance":
+            # Sort pathways per empirical p-value, ascending
+            self.produce_pathway_significance()
+            data_stats = {pth : occupancy_stats[pth] for pth in self.pathway_stats.index}
+            title = f"Top {self.view_top_n}: Targets per Pathway by significance (annotated)"
+        else:
+            # Sort pathways per amount of targets present, descending
+            data_stats = dict(sorted(occupancy_stats.items(), key=lambda item: item[1], reverse=True))
+            title = f"Top {self.view_top_n}: Targets per Pathway (annotated)"
 
         # Extract top 10
         x = list(data_stats.keys())[:self.view_top_n]   # str-int
@@ -115,7 +269,7 @@ class Enrichment:
 
         ax.set_xlabel("Pathways", fontsize=18)
         ax.set_ylabel(f"Percent of targets (total {targets_len})", fontsize=18)
-        ax.set_title("Top 10: Targets per Pathway (annotated)", fontsize=24)
+        ax.set_title(title, fontsize=24)
         ax.set_xticks(range(len(x)))
         ax.set_xticklabels(x, rotation=45, ha='right', fontsize=18)
         fig.tight_layout()
@@ -279,6 +279,40 @@ class KeggOperations:
                 print(f"Failed to retrieve pathway name for {pathway_id}: {e}")
             return None
 
+    def retrieve_organism_background(self, fn="background"):
+        """
+        Fetch all gene-pathway links for the organism from KEGG REST API.
+        Used as the background universe for permutation significance.
+        """
+        request_obj = (
+            lambda params : requests.get(url=params['url'], timeout=params['timeout']),
+            {
+                "url": f"https://rest.kegg.jp/link/pathway/{self.organism}",
+                "timeout": 60
+            }
+        )
+
+        response = Utils.fetch_with_retries(request_obj, rate_limit=0.333)
+
+        if not response.ok:
+            print(f"Error retrieving background for organism {self.organism}")
+            return
+
+        background = defaultdict(list)
+        for line in response.text.strip().split('\n'):
+            gene, _, pathway = line.partition('\t')
+            if pathway:
+                background[gene].append(pathway)
+
+        self.mapping['BACKGROUND'] = dict(background)
+        with open(os.path.join(self.output, f"{fn}.json"), "w") as ofile:
+            json.dump(self.mapping['BACKGROUND'], ofile)
+
+        print(
+            "-- BACKGROUND --","\n",
+            "Total annotated genes:", len(background)
+            )
+
     def kegg_batch(self, func, fn, ext="pkl"):
         """Batch collect and save KGML data"""
         tools = {
@@ -323,9 +357,11 @@ class KeggOperations:
         if self.verbose:
             print(f"Query {uniprot_id} - completed.")
 
-    def query_batch(self, uniprot_ids=None):
+    def query_batch(self, uniprot_ids=None, background=False):
         """Batch runs the query on a list with Uniprot IDs"""
-        for uid in tqdm(self.check(locals())):
+        for uid in tqdm(self.check({"self": self, "uniprot_ids": uniprot_ids})):
             self.query(uid)
         self.clean_pathways()
-        self.kegg_batch(self.retrieve_kegg_pathway_name, "pathways_names", "json")
\ No newline at end of file
+        self.kegg_batch(self.retrieve_kegg_pathway_name, "pathways_names", "json")
+        if background:
+            self.retrieve_organism_background()
\ No newline at end of file